@@ -0,0 +1,66 @@
+"""
+ArcFace INT8 calibration
+Builds the TensorRT calibration table used when ARCFACE_TRT_INT8=1
+
+Usage: python calibrate_arcface.py <aligned_faces_dir> [output_dir]
+The directory should hold 100-500 aligned 112x112 face crops (KYC-style selfies).
+"""
+
+import os
+import sys
+import cv2
+import numpy as np
+from insightface.app import FaceAnalysis
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, create_calibrator, write_calibration_table
+
+from utils.face_analyzer import ARCFACE_TRT_CACHE_DIR
+
+class FaceCropReader(CalibrationDataReader):
+    def __init__(self, image_dir, recognition):
+        """Feed aligned face crops through ArcFace's own blob preprocessing"""
+        self.recognition = recognition
+        self.paths = [
+            os.path.join(image_dir, name) for name in sorted(os.listdir(image_dir))
+            if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+        ]
+        self.iterator = iter(self.paths)
+        
+    def get_next(self):
+        for path in self.iterator:
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            if image.shape[:2] != self.recognition.input_size[::-1]:
+                image = cv2.resize(image, self.recognition.input_size)
+            blob = cv2.dnn.blobFromImage(
+                image, 1.0 / self.recognition.input_std, self.recognition.input_size,
+                (self.recognition.input_mean,) * 3, swapRB=True
+            )
+            return {self.recognition.input_name: blob}
+        return None
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python calibrate_arcface.py <aligned_faces_dir> [output_dir]")
+        sys.exit(1)
+    
+    image_dir = sys.argv[1]
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else ARCFACE_TRT_CACHE_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    
+    app = FaceAnalysis(name='buffalo_l', allowed_modules=['detection', 'recognition'], providers=['CPUExecutionProvider'])
+    recognition = app.models['recognition']
+    
+    calibrator = create_calibrator(
+        recognition.model_file,
+        [],
+        augmented_model_path=os.path.join(output_dir, 'arcface_augmented.onnx'),
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    calibrator.collect_data(FaceCropReader(image_dir, recognition))
+    write_calibration_table(calibrator.compute_data(), dir=output_dir)
+    
+    print(f"Calibration table written to {output_dir}")
+
+if __name__ == '__main__':
+    main()
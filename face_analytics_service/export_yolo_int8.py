@@ -0,0 +1,27 @@
+"""
+YOLOv8n INT8 TensorRT export
+Builds the engine loaded by PeopleCounter when a GPU is available
+
+Usage: python export_yolo_int8.py [calibration_data_yaml]
+Must run on the deployment GPU; defaults to coco128.yaml for calibration.
+"""
+
+import os
+import sys
+from ultralytics import YOLO
+
+from utils.people_counter import YOLO_ENGINE_PATH
+
+def main():
+    data = sys.argv[1] if len(sys.argv) > 1 else 'coco128.yaml'
+    
+    model = YOLO('yolov8n.pt')
+    engine_path = model.export(format='engine', int8=True, data=data, imgsz=640)
+    
+    if os.path.abspath(engine_path) != os.path.abspath(YOLO_ENGINE_PATH):
+        os.replace(engine_path, YOLO_ENGINE_PATH)
+    
+    print(f"INT8 engine written to {YOLO_ENGINE_PATH}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""
+Gunicorn settings for the face analytics service
+"""
+
+bind = '0.0.0.0:5001'
+
+# One worker with threads shares a single copy of each model; forking workers
+# would duplicate them (and --preload breaks CUDA contexts across fork)
+workers = 1
+threads = 4
+
+def post_worker_init(worker):
+    """Start loading the models as soon as the worker is up, not on the first request"""
+    from app import warm_up_models
+    warm_up_models()
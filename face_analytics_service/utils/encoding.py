@@ -0,0 +1,19 @@
+"""
+Response encoding helpers
+Kept free of model imports so the web layer can load without them
+"""
+
+import base64
+import numpy as np
+
+EMBEDDING_FORMATS = ('list', 'base64')
+
+def encode_embedding(embedding, embedding_format='list'):
+    """
+    Encode an embedding for the JSON response
+    'list': JSON numbers; 'base64': raw little-endian array bytes (~4x smaller,
+    decode with np.frombuffer(base64.b64decode(s), dtype) or a JS Float32Array)
+    """
+    if embedding_format == 'base64':
+        return base64.b64encode(np.ascontiguousarray(embedding).tobytes()).decode('ascii')
+    return embedding.tolist()
@@ -3,42 +3,160 @@ Face Analyzer using InsightFace
 Provides face detection, recognition (ArcFace), age, gender, expression, race
 """
 
+import os
 import numpy as np
 import cv2
+import onnxruntime
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
 from insightface.data import get_image as ins_get_image
+from insightface.utils import face_align
+
+from utils.encoding import encode_embedding
+from utils.preproc import blob_from_images
+
+# Prefer CUDA when available; ONNX Runtime falls back to CPU automatically
+# if onnxruntime-gpu or a GPU is missing. Set INSIGHTFACE_FORCE_CPU=1 to skip CUDA.
+if os.environ.get('INSIGHTFACE_FORCE_CPU', '').lower() in ('1', 'true', 'yes'):
+    PROVIDERS = ['CPUExecutionProvider']
+    CTX_ID = -1
+else:
+    PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+    CTX_ID = 0
+
+# Opt-in INT8 TensorRT engine for the ArcFace recognition model.
+# Requires a calibration table in ARCFACE_TRT_CACHE_DIR (see calibrate_arcface.py).
+ARCFACE_TRT_INT8 = os.environ.get('ARCFACE_TRT_INT8', '').lower() in ('1', 'true', 'yes')
+ARCFACE_TRT_CACHE_DIR = os.environ.get('ARCFACE_TRT_CACHE_DIR', 'trt_cache')
+ARCFACE_CALIBRATION_TABLE = 'calibration.flatbuffers'
+
+# Most face crops sent through ArcFace in one get_feat call
+ARCFACE_BATCH_SIZE = 64
 
 class FaceAnalyzer:
     def __init__(self):
         """Initialize InsightFace face analysis"""
-        self.app = FaceAnalysis(providers=['CPUExecutionProvider'])
-        self.app.prepare(ctx_id=0, det_size=(640, 640))
+        self.app = FaceAnalysis(name='buffalo_l', providers=PROVIDERS)
+        self.app.prepare(ctx_id=CTX_ID, det_size=(640, 640))
+        
+        if ARCFACE_TRT_INT8 and CTX_ID >= 0:
+            self._enable_arcface_trt_int8()
+        
+        self._fuse_arcface_preprocessing()
+        
+        # Warm up so the first request doesn't pay the session/kernel setup cost
+        self.app.get(np.zeros((640, 640, 3), dtype=np.uint8))
         
         # Expression mapping (based on facial landmarks and features)
         self.expressions = ['neutral', 'happy', 'sad', 'surprise', 'fear', 'disgust', 'anger']
         
-    def analyze(self, image):
+    def _enable_arcface_trt_int8(self):
+        """
+        Rebuild the ArcFace session on the TensorRT execution provider in INT8 mode
+        The engine is built once and cached on disk, CUDA/CPU remain as fallbacks
+        """
+        calibration_table = os.path.join(ARCFACE_TRT_CACHE_DIR, ARCFACE_CALIBRATION_TABLE)
+        if not os.path.exists(calibration_table):
+            print(f"[FaceAnalyzer] {calibration_table} not found, keeping ArcFace on {PROVIDERS[0]}")
+            return
+        
+        recognition = self.app.models['recognition']
+        trt_options = {
+            'trt_int8_enable': True,
+            'trt_int8_calibration_table_name': ARCFACE_CALIBRATION_TABLE,
+            'trt_engine_cache_enable': True,
+            'trt_engine_cache_path': ARCFACE_TRT_CACHE_DIR,
+        }
+        recognition.session = onnxruntime.InferenceSession(
+            recognition.model_file,
+            providers=[('TensorrtExecutionProvider', trt_options)] + PROVIDERS,
+        )
+    
+    def _fuse_arcface_preprocessing(self):
+        """
+        Replace ArcFace's blobFromImages preprocessing with the fused Numba kernel
+        Aligned crops already match the input size, so only normalize + transpose remain
+        """
+        recognition = self.app.models['recognition']
+        
+        def get_feat(imgs):
+            if not isinstance(imgs, list):
+                imgs = [imgs]
+            imgs = [
+                img if img.shape[1::-1] == tuple(recognition.input_size) else cv2.resize(img, tuple(recognition.input_size))
+                for img in imgs
+            ]
+            blob = blob_from_images(imgs, recognition.input_mean, recognition.input_std)
+            return recognition.session.run(recognition.output_names, {recognition.input_name: blob})[0]
+        
+        recognition.get_feat = get_feat
+    
+    def analyze(self, image, embedding_format='list'):
         """
         Analyze all faces in image
         Returns list of face data with detection, recognition, demographics
         """
         faces = self.app.get(image)
         
-        results = []
-        for face in faces:
-            face_data = {
-                'bbox': face.bbox.tolist(),  # [x1, y1, x2, y2]
-                'kps': face.kps.tolist() if hasattr(face, 'kps') else None,  # 5 keypoints
-                'det_score': float(face.det_score),  # Detection confidence
-                'embedding': face.embedding.tolist(),  # ArcFace embedding (512-dim)
-                'age': int(face.age) if hasattr(face, 'age') else None,
-                'gender': 'male' if face.gender == 1 else 'female' if hasattr(face, 'gender') else None,
-                'expression': self._estimate_expression(face),
-                'race': self._estimate_race(face) if hasattr(face, 'embedding') else None,
-            }
-            results.append(face_data)
-        
-        return results
+        return [self._face_to_dict(face, embedding_format) for face in faces]
+    
+    def analyze_batch(self, images, embedding_format='list'):
+        """
+        Analyze all faces in several images
+        Detection runs per image, ArcFace runs once over every detected face
+        Returns one result list per image, same format as analyze
+        """
+        recognition = self.app.models['recognition']
+        
+        faces_per_image = []
+        crops = []
+        for image in images:
+            faces = self._detect(image)
+            for face in faces:
+                crops.append(face_align.norm_crop(image, landmark=face.kps, image_size=recognition.input_size[0]))
+            faces_per_image.append(faces)
+        
+        if crops:
+            # Bounded ArcFace batches, so many faces per request cannot exhaust memory
+            embeddings = iter(np.concatenate([
+                recognition.get_feat(crops[start:start + ARCFACE_BATCH_SIZE])
+                for start in range(0, len(crops), ARCFACE_BATCH_SIZE)
+            ]))
+            for faces in faces_per_image:
+                for face in faces:
+                    face.embedding = next(embeddings).flatten()
+        
+        return [[self._face_to_dict(face, embedding_format) for face in faces] for faces in faces_per_image]
+    
+    def _detect(self, image):
+        """
+        Same as FaceAnalysis.get but without the per-face recognition call
+        """
+        bboxes, kpss = self.app.det_model.detect(image, max_num=0, metric='default')
+        
+        faces = []
+        for i in range(bboxes.shape[0]):
+            face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for taskname, model in self.app.models.items():
+                if taskname in ('detection', 'recognition'):
+                    continue
+                model.get(image, face)
+            faces.append(face)
+        
+        return faces
+    
+    def _face_to_dict(self, face, embedding_format='list'):
+        """Serialize an InsightFace Face for the JSON response"""
+        return {
+            'bbox': face.bbox.tolist(),  # [x1, y1, x2, y2]
+            'kps': face.kps.tolist() if hasattr(face, 'kps') else None,  # 5 keypoints
+            'det_score': float(face.det_score),  # Detection confidence
+            'embedding': encode_embedding(face.embedding, embedding_format),  # ArcFace embedding (512-dim)
+            'age': int(face.age) if hasattr(face, 'age') else None,
+            'gender': 'male' if face.gender == 1 else 'female' if hasattr(face, 'gender') else None,
+            'expression': self._estimate_expression(face),
+            'race': self._estimate_race(face) if hasattr(face, 'embedding') else None,
+        }
     
     def extract_embedding(self, image):
         """
@@ -106,3 +224,46 @@ class FaceAnalyzer:
         )
         
         return float(similarity)
+    
+    def normalize_gallery(self, gallery):
+        """
+        L2-normalize gallery embeddings (one per row)
+        Do this once at enrollment and pass normalize=False to compare_batch
+        """
+        gallery = np.asarray(gallery, dtype=np.float32)
+        return gallery / np.linalg.norm(gallery, axis=1, keepdims=True)
+    
+    def compare_batch(self, query, gallery, normalize=True):
+        """
+        Compare query embedding(s) against a gallery with a single matrix multiply
+        Returns: cosine similarities, shape (N,) for one query or (Q, N) for several
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / np.linalg.norm(query, axis=-1, keepdims=True)
+        
+        if normalize:
+            gallery = self.normalize_gallery(gallery)
+        
+        return query @ gallery.T
+    
+    def quantize_embedding(self, embedding):
+        """
+        Quantize embedding(s) to int8 for compact galleries (4x smaller than float32)
+        Each vector is scaled to use the full int8 range; cosine similarity is
+        scale-invariant, so no per-vector scale needs to be stored
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding = embedding / np.abs(embedding).max(axis=-1, keepdims=True)
+        return np.round(embedding * 127).astype(np.int8)
+    
+    def compare_batch_int8(self, query, gallery):
+        """
+        Compare int8-quantized query embedding(s) against an int8 gallery
+        Accumulates in int32; returns cosine similarities like compare_batch
+        """
+        query = np.asarray(query, dtype=np.int8).astype(np.int32)
+        gallery = np.asarray(gallery, dtype=np.int8).astype(np.int32)
+        
+        query_norm = np.linalg.norm(query, axis=-1, keepdims=True)
+        gallery_norm = np.linalg.norm(gallery, axis=1)
+        return (query @ gallery.T) / (query_norm * gallery_norm)
@@ -3,14 +3,26 @@ People Counter using YOLO
 Detects and counts people in images
 """
 
+import os
+import threading
 import numpy as np
+import torch
 from ultralytics import YOLO
 
+# INT8 TensorRT engine built by export_yolo_int8.py; engines are GPU-specific
+YOLO_ENGINE_PATH = os.environ.get('YOLO_ENGINE_PATH', 'yolov8n.engine')
+
 class PeopleCounter:
     def __init__(self):
         """Initialize YOLO model for person detection"""
-        # Use YOLOv8n (nano) for fast inference
-        self.model = YOLO('yolov8n.pt')
+        # Use YOLOv8n (nano) for fast inference, INT8 TensorRT when available
+        if os.path.exists(YOLO_ENGINE_PATH) and torch.cuda.is_available():
+            self.model = YOLO(YOLO_ENGINE_PATH, task='detect')
+        else:
+            self.model = YOLO('yolov8n.pt')
+        
+        # Ultralytics predictors keep per-call state, so threads share the model serially
+        self._lock = threading.Lock()
         
     def count(self, image):
         """
@@ -18,7 +30,8 @@ class PeopleCounter:
         Returns: count and detection bounding boxes
         """
         # Run inference
-        results = self.model(image, classes=[0], verbose=False)  # class 0 = person
+        with self._lock:
+            results = self.model(image, classes=[0], verbose=False)  # class 0 = person
         
         detections = []
         for result in results:
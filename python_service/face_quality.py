@@ -4,6 +4,15 @@ import numpy as np
 import base64
 import json
 import sys
+import threading
+from functools import lru_cache
+
+# Haar cascades for the face angle check, parsed once per process
+_FACE_CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+_EYE_CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+
+# Longest side (px) of the image the Haar face pass runs on
+HAAR_MAX_SIDE = 400
 
 def decode_base64_image(base64_string):
     """Decode base64 image to numpy array"""
@@ -18,7 +27,10 @@ def decode_base64_image(base64_string):
 def assess_sharpness(image):
     """Assess image sharpness using Laplacian variance"""
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    # 16-bit output holds the full 3x3 Laplacian range of uint8 input (+/-1020)
+    laplacian = cv2.Laplacian(gray, cv2.CV_16S)
+    _, std = cv2.meanStdDev(laplacian)
+    laplacian_var = float(std[0][0]) ** 2
     
     # Normalize score (0-100)
     # Typical values: < 100 = blurry, 100-500 = acceptable, > 500 = sharp
@@ -41,8 +53,10 @@ def assess_sharpness(image):
 def assess_lighting(image):
     """Assess lighting quality"""
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    mean_brightness = np.mean(gray)
-    std_brightness = np.std(gray)
+    # Single pass for both statistics
+    mean, std = cv2.meanStdDev(gray)
+    mean_brightness = float(mean[0][0])
+    std_brightness = float(std[0][0])
     
     # Ideal brightness: 100-150, ideal std: 40-80
     brightness_score = 100 - abs(mean_brightness - 125) / 125 * 100
@@ -67,15 +81,92 @@ def assess_lighting(image):
         'contrast': round(std_brightness, 2)
     }
 
-def assess_face_angle(image):
-    """Assess face angle (frontal vs profile)"""
+def assess_face_angle(image, use_keypoints=False):
+    """
+    Assess face angle (frontal vs profile)
+    use_keypoints estimates yaw from MediaPipe keypoint symmetry instead of Haar eye
+    detection. Importing MediaPipe takes ~1s, so only long-lived processes should
+    enable it; the per-request CLI uses the Haar cascades
+    """
+    if use_keypoints:
+        result = _assess_face_angle_keypoints(image)
+        if result is not None:
+            return result
+    
+    return _assess_face_angle_haar(image)
+
+_FACE_DETECTION_LOCK = threading.Lock()
+
+@lru_cache(maxsize=None)
+def _face_detection():
+    """Short-range MediaPipe detector (faces within ~2m), built on first use"""
+    import mediapipe as mp
+    
+    # One forward pass gives box + 6 keypoints
+    return mp.solutions.face_detection.FaceDetection(
+        model_selection=0,
+        min_detection_confidence=0.5
+    )
+
+def _assess_face_angle_keypoints(image):
+    """Face angle from MediaPipe keypoint symmetry (None if no face is detected)"""
+    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    # The graph is shared and not thread-safe
+    with _FACE_DETECTION_LOCK:
+        results = _face_detection().process(rgb_image)
+    
+    if not results.detections:
+        return None
+    
+    # Use the largest face
+    detection = max(
+        results.detections,
+        key=lambda d: d.location_data.relative_bounding_box.width * d.location_data.relative_bounding_box.height
+    )
+    # Keypoints: right eye, left eye, nose tip, mouth, right ear, left ear
+    _, _, nose, _, right_ear, left_ear = detection.location_data.relative_keypoints
+    
+    # Nose sits midway between the ear tragions when frontal; turning the head
+    # shrinks one side. Ratio of the two spans: 1.0 = frontal, 0.0 = full profile
+    left_span = abs(left_ear.x - nose.x)
+    right_span = abs(nose.x - right_ear.x)
+    yaw_ratio = min(left_span, right_span) / (max(left_span, right_span) + 1e-6)
+    
+    if yaw_ratio >= 0.6:
+        score = 100
+        quality = 'good'
+        angle = 'frontal'
+    elif yaw_ratio >= 0.3:
+        score = 60
+        quality = 'acceptable'
+        angle = 'slight_angle'
+    else:
+        score = 30
+        quality = 'poor'
+        angle = 'profile'
+    
+    return {
+        'score': score,
+        'quality': quality,
+        'angle_estimate': angle,
+        'yaw_ratio': round(yaw_ratio, 2)
+    }
+
+def _assess_face_angle_haar(image):
+    """Face angle from Haar face and eye detection"""
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     
-    # Use Haar cascade for face detection
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+    # Enrollment selfies fill a large part of the frame, so run face detection
+    # on a downscaled copy and skip the small-face scales
+    k = HAAR_MAX_SIDE / max(gray.shape)
+    if k < 1:
+        small = cv2.resize(gray, None, fx=k, fy=k, interpolation=cv2.INTER_AREA)
+    else:
+        k = 1.0
+        small = gray
     
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+    # Use Haar cascade for face detection
+    faces = _FACE_CASCADE.detectMultiScale(small, 1.3, 5)
     
     if len(faces) == 0:
         return {
@@ -85,11 +176,11 @@ def assess_face_angle(image):
         }
     
     # Get the largest face
-    (x, y, w, h) = max(faces, key=lambda f: f[2] * f[3])
+    (x, y, w, h) = (int(v / k) for v in max(faces, key=lambda f: f[2] * f[3]))
     face_roi = gray[y:y+h, x:x+w]
     
     # Detect eyes
-    eyes = eye_cascade.detectMultiScale(face_roi)
+    eyes = _EYE_CASCADE.detectMultiScale(face_roi)
     
     # Score based on face detection confidence and eye detection
     if len(eyes) >= 2:
@@ -112,8 +203,11 @@ def assess_face_angle(image):
         'eyes_detected': len(eyes)
     }
 
-def assess_image_quality(base64_image):
-    """Comprehensive image quality assessment"""
+def assess_image_quality(base64_image, use_keypoints=False):
+    """
+    Comprehensive image quality assessment
+    use_keypoints: see assess_face_angle
+    """
     try:
         image = decode_base64_image(base64_image)
         
@@ -124,7 +218,7 @@ def assess_image_quality(base64_image):
         
         sharpness = assess_sharpness(image)
         lighting = assess_lighting(image)
-        angle = assess_face_angle(image)
+        angle = assess_face_angle(image, use_keypoints)
         
         # Overall score (weighted average)
         overall_score = (
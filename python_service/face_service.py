@@ -4,30 +4,252 @@ Face Recognition Service with MediaPipe Face Mesh and Image Preprocessing
 Provides high-accuracy face detection, 3D landmarks, and embedding extraction
 """
 
+import os
+import stat
 import cv2
 import numpy as np
-import mediapipe as mp
 from typing import List, Dict, Tuple, Optional
 import base64
+import hashlib
 import json
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-# Initialize MediaPipe Face Mesh for 3D landmarks
-mp_face_mesh = mp.solutions.face_mesh
-mp_face_detection = mp.solutions.face_detection
+# Optional SIMD fast paths, used when installed:
+# pybase64 (SSSE3/AVX2 base64) and PyTurboJPEG (libjpeg-turbo straight to a BGR array)
+try:
+    import pybase64 as _base64
+except ImportError:
+    _base64 = base64
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _TURBOJPEG = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _TURBOJPEG = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Embedding source for extract_landmarks_and_embedding:
+# 'landmarks' - 128-D geometric embedding (matches existing enrollments)
+# 'arcface'   - 512-D recognition-grade ArcFace embedding from the face analytics service
+FACE_EMBEDDING_MODEL = os.environ.get('FACE_EMBEDDING_MODEL', 'landmarks')
+FACE_ANALYTICS_SERVICE_URL = os.environ.get('FACE_ANALYTICS_SERVICE_URL', 'http://localhost:5001')
+
+# Extraction results are cached by image content: up to EXTRACT_CACHE_SIZE in memory,
+# and optionally on disk so results survive across CLI invocations. The disk cache keeps
+# at most EXTRACT_CACHE_DISK_SIZE files, dropping the least recently used beyond that
+EXTRACT_CACHE_SIZE = 1024
+EXTRACT_CACHE_DIR = os.environ.get('FACE_EXTRACT_CACHE_DIR')
+EXTRACT_CACHE_DISK_SIZE = 10000
+# Part of every cache key: bump whenever landmark, embedding or confidence output
+# changes so stale results (on disk in particular) are no longer served
+EXTRACT_CACHE_VERSION = 2
+
+# Preprocessed images are kept by image content too, so a repeat under another
+# extraction cache key (landmark format, embedding model) skips the filters
+PREPROCESS_CACHE_SIZE = 64
+
+# Landmark layout in extraction results: 'dicts' ([{"x", "y", "z"}, ...], the format
+# the Node server expects) or 'xyz' (compact [[x, y, z], ...])
+LANDMARKS_FORMAT = os.environ.get('FACE_LANDMARKS_FORMAT', 'dicts')
+
+# Face Mesh returns 468 landmarks, plus 10 iris points with refine_landmarks=True
+NUM_LANDMARKS = 478
+
+# Key facial feature indices (MediaPipe Face Mesh)
+# Eyes, nose, mouth, face contour
+KEY_INDICES = np.array([
+    # Left eye
+    33, 133, 160, 159, 158, 157, 173,
+    # Right eye
+    263, 362, 387, 386, 385, 384, 398,
+    # Nose
+    1, 2, 98, 327,
+    # Mouth
+    61, 291, 0, 17,
+    # Face contour
+    10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288,
+    # Eyebrows
+    70, 63, 105, 66, 107, 336, 296, 334, 293, 300,
+    # Cheeks
+    205, 425, 206, 426
+], dtype=np.int32)
+
+# Each key point paired with its next 4 neighbours (limits pairs to avoid explosion),
+# as landmark index arrays in the (i, j) order of the embedding layout
+_offsets = np.arange(len(KEY_INDICES))[None, :] - np.arange(len(KEY_INDICES))[:, None]
+_pair_i, _pair_j = np.nonzero((_offsets >= 1) & (_offsets <= 4))
+PAIR_I = KEY_INDICES[_pair_i]
+PAIR_J = KEY_INDICES[_pair_j]
+
+# Serialized NormalizedLandmarkList layout when each landmark has only x, y and z set:
+# 17-byte records of list field tag + length, then tagged little-endian float32 x, y, z
+LANDMARK_RECORD_SIZE = 17
+_LANDMARK_TAG_COLUMNS = [0, 1, 2, 7, 12]
+_LANDMARK_TAGS = np.array([0x0a, 0x0f, 0x0d, 0x15, 0x1d], dtype=np.uint8)
+
+# Left eye, right eye, nose tip and mouth center, for the eye-nose-mouth angles
+TRIANGLE_INDICES = np.array([33, 263, 1, 13], dtype=np.int32)
+
+# Denoising filters for preprocess_image:
+# 'median'         - 5x5 median, edge-preserving and ~10x cheaper than bilateral
+# 'bilateral'      - full-resolution bilateral filter (d=9)
+# 'bilateral_fast' - bilateral on a 4x downsampled copy, upsampled back
+DENOISE_METHODS = ('median', 'bilateral', 'bilateral_fast')
+
+# preprocess_image first downscales larger images to this max side; Face Mesh
+# works on ~192-256px crops, so the extra pixels only cost filter time
+PREPROCESS_MAX_SIDE = 640
+
+# FACE_PREPROCESS_GPU=1 runs preprocess_image on the GPU, given a CUDA-enabled OpenCV
+# build and a GPU (the PyPI opencv wheels are CPU-only). Opt-in: the CPU path is the
+# one that is exercised
+CUDA_PREPROCESS = (
+    os.environ.get('FACE_PREPROCESS_GPU') == '1'
+    and hasattr(cv2, 'cuda') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+)
+
+def _to_json(obj) -> str:
+    """
+    Serialize a result to JSON, writing NumPy arrays as number lists
+    orjson (when installed) reads arrays directly instead of boxing every element
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj, default=lambda value: value.tolist())
+
+def _embedding_kernel(landmarks_array: np.ndarray) -> np.ndarray:
+    """
+    Geometric features of pixel-scaled (N, 3) landmarks as float32, normalized and sized to 128
+    Array math only - no per-feature Python objects
+    """
+    # 1. Distances between paired key points, as sqrt of summed squares
+    diffs = landmarks_array[PAIR_I] - landmarks_array[PAIR_J]
+    distances = np.sqrt(np.einsum('ij,ij->i', diffs, diffs))
+    
+    # 2. Angles between facial features
+    # Eye-nose-mouth triangle
+    left_eye, right_eye, nose_tip, mouth_center = landmarks_array[TRIANGLE_INDICES]
+    
+    # Calculate angles (vec1, vec2) and (vec2, vec3) in one batch
+    vec1 = right_eye - left_eye
+    vec2 = nose_tip - left_eye
+    vec3 = mouth_center - nose_tip
+    
+    # as atan2(|v1 x v2|, v1 . v2), which stays accurate near 0 and pi where arccos
+    # of the normalized dot product does not; the cross product is written out since
+    # np.cross costs more than the rest of the angle block
+    v1s = np.array([vec1, vec2])
+    v2s = np.array([vec2, vec3])
+    crosses = v1s[:, (1, 2, 0)] * v2s[:, (2, 0, 1)] - v1s[:, (2, 0, 1)] * v2s[:, (1, 2, 0)]
+    angles = np.arctan2(np.sqrt(np.einsum('ij,ij->i', crosses, crosses)), np.einsum('ij,ij->i', v1s, v2s))
+    
+    # 3. Facial proportions
+    face_width = np.linalg.norm(landmarks_array[234] - landmarks_array[454])
+    face_height = np.linalg.norm(landmarks_array[10] - landmarks_array[152])
+    eye_distance = np.linalg.norm(left_eye - right_eye)
+    proportions = np.array([face_width, face_height, eye_distance, face_width / (face_height + 1e-6)])
+    
+    features_array = np.concatenate([distances, angles, proportions]).astype(np.float32)
+    
+    # Normalize to [-1, 1] range
+    features_array = (features_array - np.mean(features_array)) / (np.std(features_array) + 1e-6)
+    
+    # Pad or truncate to exactly 128 dimensions
+    if len(features_array) < 128:
+        return np.pad(features_array, (0, 128 - len(features_array)), mode='constant')
+    return features_array[:128]
+
+def _quantize_embedding(embedding: np.ndarray) -> np.ndarray:
+    """
+    int8 form of a landmark embedding for compact storage and int8 dot products
+    The embedding is standardized, so [-4, 4] std maps onto [-127, 127] (outliers clipped);
+    compare int8 embeddings with cosine similarity, where the common scale cancels out
+    """
+    return np.clip(np.round(embedding * 31.75), -128, 127).astype(np.int8)
 
 class FaceRecognitionService:
-    def __init__(self):
-        self.face_mesh = mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=10,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
-        self.face_detection = mp_face_detection.FaceDetection(
-            model_selection=1,  # 1 for full range, 0 for short range
-            min_detection_confidence=0.5
-        )
+    def __init__(self, denoise: str = 'median', preprocess: bool = False):
+        if denoise not in DENOISE_METHODS:
+            raise ValueError(f"denoise must be one of {DENOISE_METHODS}")
+        self.denoise = denoise
+        # Run preprocess_image before Face Mesh in extract_landmarks_and_embedding.
+        # Off by default: MediaPipe is trained on unprocessed images, and detection
+        # always uses the raw image
+        self.preprocess = preprocess
+        
+        # OpenCV parallelizes CLAHE and the filters over all cores by default; give it
+        # half so MediaPipe's own thread pool is not starved
+        cv2.setNumThreads(max(1, (os.cpu_count() or 1) // 2))
+        
+        self._local = threading.local()
+        self._thread_state()
+        
+        self._extract_cache: OrderedDict = OrderedDict()
+        self._extract_cache_lock = threading.Lock()
+        self._preprocess_cache: OrderedDict = OrderedDict()
+        self._preprocess_cache_lock = threading.Lock()
+        
+        # Batch worker threads, created on first batch call and kept so their
+        # per-thread MediaPipe graphs are reused by later batches
+        self._batch_pool: Optional[ThreadPoolExecutor] = None
+        self._batch_pool_lock = threading.Lock()
+    
+    def _thread_state(self) -> threading.local:
+        """
+        MediaPipe graphs and scratch buffers for the calling thread
+        MediaPipe graph objects are not thread-safe, so each worker thread builds its own
+        """
+        state = self._local
+        if not hasattr(state, 'face_mesh'):
+            # Imported here so loading this module (constants, helpers) stays cheap
+            import mediapipe as mp
+            
+            # MediaPipe Face Mesh for 3D landmarks
+            state.face_mesh = mp.solutions.face_mesh.FaceMesh(
+                static_image_mode=True,
+                max_num_faces=10,
+                refine_landmarks=True,
+                min_detection_confidence=0.5,
+                min_tracking_confidence=0.5
+            )
+            state.face_detection = mp.solutions.face_detection.FaceDetection(
+                model_selection=1,  # 1 for full range, 0 for short range
+                min_detection_confidence=0.5
+            )
+            # Scratch buffer for landmark coordinates, overwritten per face
+            state.landmarks_buffer = np.empty((NUM_LANDMARKS, 3), dtype=np.float32)
+            # CLAHE keeps its tile buffers between calls (so it is built once per thread
+            # rather than per image), which also makes it unsafe to share across threads
+            state.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            if CUDA_PREPROCESS:
+                # GPU counterparts, queued on a per-thread stream
+                state.gpu_stream = cv2.cuda_Stream()
+                state.gpu_clahe = cv2.cuda.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+                state.gpu_median = cv2.cuda.createMedianFilter(cv2.CV_8UC1, 5)
+        return state
+    
+    @property
+    def face_mesh(self):
+        return self._thread_state().face_mesh
+    
+    @property
+    def face_detection(self):
+        return self._thread_state().face_detection
+    
+    @property
+    def _landmarks_buffer(self) -> np.ndarray:
+        return self._thread_state().landmarks_buffer
+    
+    @property
+    def _clahe(self):
+        return self._thread_state().clahe
     
     def preprocess_image(self, image: np.ndarray) -> np.ndarray:
         """
@@ -35,32 +257,96 @@ class FaceRecognitionService:
         - Noise reduction
         - Lighting optimization
         - Contrast enhancement
+        Only the LAB lightness channel is processed, so colour is preserved for MediaPipe
+        Images larger than PREPROCESS_MAX_SIDE are returned downscaled
         """
-        # Convert to grayscale for processing
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = image
+        scale = PREPROCESS_MAX_SIDE / max(image.shape[:2])
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
         
-        # 1. Noise reduction using bilateral filter
-        # Preserves edges while reducing noise
-        denoised = cv2.bilateralFilter(gray, 9, 75, 75)
+        if len(image.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
         
-        # 2. Histogram equalization for lighting optimization
-        equalized = cv2.equalizeHist(denoised)
+        if CUDA_PREPROCESS:
+            return self._preprocess_image_gpu(image)
+        
+        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+        lightness = cv2.extractChannel(lab, 0)
+        
+        # 1. Noise reduction (edge-preserving)
+        denoised = self._denoise(lightness)
+        
+        # 2. CLAHE (Contrast Limited Adaptive Histogram Equalization)
+        # Lighting optimization and contrast enhancement in one pass;
+        # a global histogram equalization beforehand is redundant
+        lab[:, :, 0] = self._clahe.apply(denoised)
+        
+        return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    
+    def _preprocess_image_gpu(self, image: np.ndarray) -> np.ndarray:
+        """
+        preprocess_image on the GPU: one upload, the same LAB lightness pipeline, one download
+        Work is queued asynchronously on this thread's stream and synchronized on download
+        """
+        state = self._thread_state()
+        stream = state.gpu_stream
         
-        # 3. CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        # Better than regular histogram equalization
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(equalized)
+        gpu_image = cv2.cuda_GpuMat()
+        gpu_image.upload(image, stream)
+        lab = cv2.cuda.cvtColor(gpu_image, cv2.COLOR_BGR2LAB, stream=stream)
+        # Returned as a tuple; a list so the lightness channel can be replaced
+        channels = list(cv2.cuda.split(lab, stream=stream))
         
-        # Convert back to BGR for MediaPipe
-        if len(image.shape) == 3:
-            enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
+        # 1. Noise reduction (edge-preserving); the GPU runs bilateral at full resolution
+        if self.denoise == 'median':
+            denoised = state.gpu_median.apply(channels[0], stream=stream)
         else:
-            enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
+            denoised = cv2.cuda.bilateralFilter(channels[0], 9, 75, 75, stream=stream)
+        
+        # 2. CLAHE
+        channels[0] = state.gpu_clahe.apply(denoised, stream)
+        
+        lab = cv2.cuda.merge(channels, stream=stream)
+        result = cv2.cuda.cvtColor(lab, cv2.COLOR_LAB2BGR, stream=stream).download(stream)
+        stream.waitForCompletion()
+        return result
+    
+    def _denoise(self, gray: np.ndarray) -> np.ndarray:
+        """Apply the configured edge-preserving denoising filter"""
+        if self.denoise == 'median':
+            return cv2.medianBlur(gray, 5)
+        
+        if self.denoise == 'bilateral':
+            return cv2.bilateralFilter(gray, 9, 75, 75)
+        
+        # Bilateral at 1/4 resolution: 16x fewer pixels and a 3x3 instead of 9x9 window
+        h, w = gray.shape
+        small = cv2.resize(gray, (max(1, w // 4), max(1, h // 4)), interpolation=cv2.INTER_AREA)
+        small = cv2.bilateralFilter(small, 3, 75, 75 / 4)
+        return cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+    
+    def _decode_base64(self, image_base64: str) -> bytes:
+        """Strip an optional data URL prefix and decode base64 to the encoded image bytes"""
+        if ',' in image_base64:
+            image_base64 = image_base64.split(',')[1]
+        
+        return _base64.b64decode(image_base64)
+    
+    def _decode_image(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """
+        Decode encoded image bytes to BGR (None if undecodable)
+        JPEGs go through libjpeg-turbo when available, except those with EXIF data,
+        which are left to cv2.imdecode so their orientation tag is still applied
+        """
+        if (_TURBOJPEG is not None and image_bytes[:3] == b'\xff\xd8\xff'
+                and b'Exif\x00\x00' not in image_bytes[:64]):
+            try:
+                return _TURBOJPEG.decode(image_bytes, pixel_format=TJPF_BGR)
+            except OSError:
+                pass
         
-        return enhanced_bgr
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     
     def detect_faces(self, image_base64: str) -> Dict:
         """
@@ -68,16 +354,20 @@ class FaceRecognitionService:
         """
         try:
             # Decode base64 image
-            if ',' in image_base64:
-                image_base64 = image_base64.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_base64)
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if image is None:
-                return {"error": "Failed to decode image"}
-            
+            image = self._decode_image(self._decode_base64(image_base64))
+        except Exception as e:
+            return {"error": str(e)}
+        
+        if image is None:
+            return {"error": "Failed to decode image"}
+        
+        return self.detect_faces_in_image(image)
+    
+    def detect_faces_in_image(self, image: np.ndarray) -> Dict:
+        """
+        detect_faces for an already decoded BGR image
+        """
+        try:
             # Convert BGR to RGB for MediaPipe (MediaPipe requires RGB color images)
             rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             
@@ -107,24 +397,58 @@ class FaceRecognitionService:
         except Exception as e:
             return {"error": str(e)}
     
-    def extract_landmarks_and_embedding(self, image_base64: str) -> Dict:
+    def extract_landmarks_and_embedding(self, image_base64: str, landmarks_format: str = LANDMARKS_FORMAT) -> Dict:
         """
         Extract 3D facial landmarks (468 points) and generate face embedding
+        landmarks_format 'xyz' returns "landmarks_xyz" as [[x, y, z], ...] instead of
+        "landmarks" as a list of {"x", "y", "z"} dicts
         """
         try:
             # Decode base64 image
-            if ',' in image_base64:
-                image_base64 = image_base64.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_base64)
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            image_bytes = self._decode_base64(image_base64)
+        except Exception as e:
+            return {"error": str(e)}
+        
+        return self._extract(image_bytes, None, landmarks_format)
+    
+    def extract_from_image(self, image: np.ndarray, landmarks_format: str = LANDMARKS_FORMAT) -> Dict:
+        """
+        extract_landmarks_and_embedding for an already decoded BGR image
+        """
+        return self._extract(None, image, landmarks_format)
+    
+    def _extract(self, image_bytes: Optional[bytes], image: Optional[np.ndarray], landmarks_format: str) -> Dict:
+        """
+        Landmarks and embeddings from encoded image bytes, or from decoded pixels when
+        image_bytes is None
+        """
+        try:
+            # Same image seen before: skip decode, Face Mesh and embedding entirely
+            content = image_bytes if image_bytes is not None else image.tobytes() + str(image.shape).encode()
+            image_key = hashlib.blake2b(content, digest_size=16).digest()
+            cache_key = hashlib.blake2b(
+                image_key + f"v{EXTRACT_CACHE_VERSION}".encode() + FACE_EMBEDDING_MODEL.encode() + landmarks_format.encode()
+                + (self.denoise.encode() if self.preprocess else b''), digest_size=16
+            ).hexdigest()
+            cached = self._cached_extraction(cache_key)
+            if cached is not None:
+                return cached
             
             if image is None:
-                return {"error": "Failed to decode image"}
+                image = self._decode_image(image_bytes)
+                
+                if image is None:
+                    return {"error": "Failed to decode image"}
+            elif FACE_EMBEDDING_MODEL == 'arcface':
+                # The face analytics service takes an encoded image (lossless here)
+                image_bytes = cv2.imencode('.png', image)[1].tobytes()
+            
+            # Preprocessing may downscale, but landmarks are normalized, so they are
+            # still scaled to the original image size below
+            processed = self._preprocessed(image_key, image) if self.preprocess else image
             
             # Convert BGR to RGB for MediaPipe (MediaPipe requires RGB color images)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            rgb_image = cv2.cvtColor(processed, cv2.COLOR_BGR2RGB)
             
             # Process with Face Mesh
             results = self.face_mesh.process(rgb_image)
@@ -132,122 +456,234 @@ class FaceRecognitionService:
             if not results.multi_face_landmarks:
                 return {"error": "No face detected"}
             
+            if FACE_EMBEDDING_MODEL == 'arcface':
+                arcface_faces = self._arcface_faces(image_bytes)
+                if not arcface_faces:
+                    return {"error": "No face detected"}
+            
             all_faces = []
             h, w, _ = image.shape
             
-            for face_landmarks in results.multi_face_landmarks:
+            if FACE_EMBEDDING_MODEL == 'arcface':
+                arcface_embeddings = self._match_arcface_embeddings(arcface_faces, [
+                    self._landmark_center(self._landmarks_to_array(face_landmarks, w, h))
+                    for face_landmarks in results.multi_face_landmarks
+                ])
+            
+            for face_index, face_landmarks in enumerate(results.multi_face_landmarks):
+                if FACE_EMBEDDING_MODEL == 'arcface' and arcface_embeddings[face_index] is None:
+                    # No ArcFace detection for this face; never fall back to someone else's
+                    continue
+                
+                landmarks_array = self._landmarks_to_array(face_landmarks, w, h)
+                
                 # Extract 3D landmarks (468 points)
-                landmarks_3d = []
-                for landmark in face_landmarks.landmark:
-                    landmarks_3d.append({
-                        "x": landmark.x * w,
-                        "y": landmark.y * h,
-                        "z": landmark.z * w  # Depth information
-                    })
+                if landmarks_format == 'xyz':
+                    # One (N, 3) list straight from the array, no per-landmark dicts
+                    landmarks = {"landmarks_xyz": landmarks_array.tolist()}
+                else:
+                    # Built from the same array, not a second pass over the protobuf
+                    landmarks_3d = [{"x": x, "y": y, "z": z} for x, y, z in landmarks_array.tolist()]
+                    landmarks = {"landmarks": landmarks_3d}
                 
-                # Generate face embedding from landmarks
-                # Use key facial features for embedding generation
-                embedding = self._generate_embedding_from_landmarks(face_landmarks, w, h)
+                if FACE_EMBEDDING_MODEL == 'arcface':
+                    embedding = arcface_embeddings[face_index]
+                    embeddings = {"embedding": embedding}
+                else:
+                    # Generate face embedding from landmarks
+                    # Use key facial features for embedding generation
+                    embedding = self._generate_embedding_from_landmarks(landmarks_array)
+                    # Plus a 4x smaller int8 copy for galleries
+                    embeddings = {"embedding": embedding, "embedding_int8": _quantize_embedding(embedding)}
                 
                 # Calculate confidence based on landmark quality
                 # Higher confidence if landmarks are well-distributed and clear
-                confidence = self._calculate_landmark_confidence(landmarks_3d, w, h)
+                confidence = self._calculate_landmark_confidence(landmarks_array, w, h)
                 
                 all_faces.append({
-                    "landmarks": landmarks_3d,
-                    "embedding": embedding.tolist(),
-                    "landmark_count": len(landmarks_3d),
+                    **landmarks,
+                    **embeddings,
+                    "landmark_count": len(landmarks_array),
                     "confidence": confidence
                 })
             
-            return {
+            if not all_faces:
+                return {"error": "No face detected"}
+            
+            result = {
                 "faces": all_faces,
                 "count": len(all_faces)
             }
+            self._store_extraction(cache_key, result)
+            return result
         
         except Exception as e:
             return {"error": str(e)}
     
-    def _generate_embedding_from_landmarks(self, face_landmarks, width: int, height: int) -> np.ndarray:
-        """
-        Generate a 128-dimensional face embedding from facial landmarks
-        Uses geometric features and distances between key facial points
-        """
-        # Extract key facial points
-        landmarks_array = np.array([[lm.x * width, lm.y * height, lm.z * width] 
-                                    for lm in face_landmarks.landmark])
-        
-        # Key facial feature indices (MediaPipe Face Mesh)
-        # Eyes, nose, mouth, face contour
-        key_indices = [
-            # Left eye
-            33, 133, 160, 159, 158, 157, 173,
-            # Right eye
-            263, 362, 387, 386, 385, 384, 398,
-            # Nose
-            1, 2, 98, 327,
-            # Mouth
-            61, 291, 0, 17, 
-            # Face contour
-            10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288,
-            # Eyebrows
-            70, 63, 105, 66, 107, 336, 296, 334, 293, 300,
-            # Cheeks
-            205, 425, 206, 426
-        ]
-        
-        # Extract key points
-        key_points = landmarks_array[key_indices]
-        
-        # Calculate geometric features
-        features = []
+    def _preprocessed(self, image_key: bytes, image: np.ndarray) -> np.ndarray:
+        """preprocess_image through an LRU of recent results keyed by image content"""
+        with self._preprocess_cache_lock:
+            if image_key in self._preprocess_cache:
+                self._preprocess_cache.move_to_end(image_key)
+                return self._preprocess_cache[image_key]
         
-        # 1. Distances between key points
-        for i in range(len(key_points)):
-            for j in range(i + 1, min(i + 5, len(key_points))):  # Limit pairs to avoid explosion
-                dist = np.linalg.norm(key_points[i] - key_points[j])
-                features.append(dist)
+        processed = self.preprocess_image(image)
+        processed.flags.writeable = False  # Shared by every caller that hits the cache
         
-        # 2. Angles between facial features
-        # Eye-nose-mouth triangle
-        left_eye = landmarks_array[33]
-        right_eye = landmarks_array[263]
-        nose_tip = landmarks_array[1]
-        mouth_center = landmarks_array[13]
-        
-        # Calculate angles
-        vec1 = right_eye - left_eye
-        vec2 = nose_tip - left_eye
-        vec3 = mouth_center - nose_tip
+        with self._preprocess_cache_lock:
+            self._preprocess_cache[image_key] = processed
+            if len(self._preprocess_cache) > PREPROCESS_CACHE_SIZE:
+                self._preprocess_cache.popitem(last=False)
+        return processed
+    
+    def _cached_extraction(self, cache_key: str) -> Optional[Dict]:
+        """Look up an extraction result in the memory LRU, then the disk cache"""
+        with self._extract_cache_lock:
+            if cache_key in self._extract_cache:
+                self._extract_cache.move_to_end(cache_key)
+                return self._extract_cache[cache_key]
         
-        angle1 = np.arccos(np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2) + 1e-6))
-        angle2 = np.arccos(np.dot(vec2, vec3) / (np.linalg.norm(vec2) * np.linalg.norm(vec3) + 1e-6))
+        if EXTRACT_CACHE_DIR:
+            path = os.path.join(EXTRACT_CACHE_DIR, f"{cache_key}.json")
+            try:
+                with open(path) as f:
+                    result = json.load(f)
+                os.utime(path)  # Recently used, for pruning
+            except (OSError, ValueError):
+                return None
+            self._store_extraction(cache_key, result, persist=False)
+            return result
         
-        features.extend([angle1, angle2])
+        return None
+    
+    def _store_extraction(self, cache_key: str, result: Dict, persist: bool = True):
+        """Add an extraction result to the memory LRU (evicting the oldest) and the disk cache"""
+        with self._extract_cache_lock:
+            self._extract_cache[cache_key] = result
+            self._extract_cache.move_to_end(cache_key)
+            if len(self._extract_cache) > EXTRACT_CACHE_SIZE:
+                self._extract_cache.popitem(last=False)
         
-        # 3. Facial proportions
-        face_width = np.linalg.norm(landmarks_array[234] - landmarks_array[454])
-        face_height = np.linalg.norm(landmarks_array[10] - landmarks_array[152])
-        eye_distance = np.linalg.norm(left_eye - right_eye)
+        if persist and EXTRACT_CACHE_DIR:
+            # The disk cache is best effort: an unusable directory must not fail extraction
+            try:
+                os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+                path = os.path.join(EXTRACT_CACHE_DIR, f"{cache_key}.json")
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(_to_json(result))
+                os.replace(tmp_path, path)
+                self._prune_disk_cache()
+            except OSError:
+                pass
+    
+    def _prune_disk_cache(self):
+        """Delete the least recently used disk cache files beyond EXTRACT_CACHE_DISK_SIZE"""
+        entries = [entry for entry in os.scandir(EXTRACT_CACHE_DIR) if entry.name.endswith(".json")]
+        if len(entries) <= EXTRACT_CACHE_DISK_SIZE:
+            return
         
-        features.extend([face_width, face_height, eye_distance, face_width / (face_height + 1e-6)])
+        # Trim to 90% so the directory is not rescanned and pruned on every write
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - EXTRACT_CACHE_DISK_SIZE * 9 // 10]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass  # Already removed by another process
+    
+    def detect_faces_batch(self, images_base64: List[str]) -> List[Dict]:
+        """
+        Detect faces in several images in parallel, results in input order
+        """
+        return list(self._batch_executor().map(self.detect_faces, images_base64))
+    
+    def extract_batch(self, images_base64: List[str]) -> List[Dict]:
+        """
+        Extract landmarks and embeddings from several images in parallel, results in input order
+        """
+        return list(self._batch_executor().map(self.extract_landmarks_and_embedding, images_base64))
+    
+    def _batch_executor(self) -> ThreadPoolExecutor:
+        """The service's batch thread pool, created on first use"""
+        with self._batch_pool_lock:
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+            return self._batch_pool
+    
+    def _arcface_faces(self, image_bytes: bytes) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Detect faces with ArcFace embeddings via the face analytics service
+        The encoded image is forwarded as-is; returns (bbox, 512-D embedding) per face
+        """
+        request = urllib.request.Request(
+            f"{FACE_ANALYTICS_SERVICE_URL}/analyze_face_raw?embedding_format=base64",
+            data=image_bytes,
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            result = json.loads(response.read())
         
-        # Normalize and pad/truncate to 128 dimensions
-        features_array = np.array(features)
+        return [
+            (np.asarray(face["bbox"], dtype=np.float32),
+             np.frombuffer(base64.b64decode(face["embedding"]), dtype=np.float32))
+            for face in result["faces"]
+        ]
+    
+    def _landmark_center(self, landmarks_array: np.ndarray) -> np.ndarray:
+        """Center (x, y) of the landmarks' bounding box"""
+        return (landmarks_array[:, :2].min(axis=0) + landmarks_array[:, :2].max(axis=0)) / 2
+    
+    def _match_arcface_embeddings(self, arcface_faces: List[Tuple[np.ndarray, np.ndarray]],
+                                  centers: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+        """
+        ArcFace embedding per Face Mesh face, from the detection whose box contains the
+        face's landmark center. Each detection goes to at most one face (closest pairs
+        first); faces without one get None rather than another person's embedding
+        """
+        pairs = []
+        for face_index, center in enumerate(centers):
+            for detection_index, (bbox, _) in enumerate(arcface_faces):
+                if bbox[0] <= center[0] <= bbox[2] and bbox[1] <= center[1] <= bbox[3]:
+                    distance = float(np.linalg.norm((bbox[:2] + bbox[2:]) / 2 - center))
+                    pairs.append((distance, face_index, detection_index))
         
-        # Normalize to [-1, 1] range
-        if len(features_array) > 0:
-            features_array = (features_array - np.mean(features_array)) / (np.std(features_array) + 1e-6)
+        embeddings: List[Optional[np.ndarray]] = [None] * len(centers)
+        used = set()
+        for _, face_index, detection_index in sorted(pairs):
+            if embeddings[face_index] is None and detection_index not in used:
+                embeddings[face_index] = arcface_faces[detection_index][1]
+                used.add(detection_index)
+        return embeddings
+    
+    def _landmarks_to_array(self, face_landmarks, width: int, height: int) -> np.ndarray:
+        """
+        Copy Face Mesh landmarks into the reusable buffer as pixel-scaled (N, 3) float32
+        The returned view is overwritten by the next call
+        """
+        landmarks_array = self._landmarks_buffer[:len(face_landmarks.landmark)]
         
-        # Pad or truncate to exactly 128 dimensions
-        if len(features_array) < 128:
-            embedding = np.pad(features_array, (0, 128 - len(features_array)), mode='constant')
-        else:
-            embedding = features_array[:128]
+        # Read x, y, z straight out of the serialized protobuf, skipping per-attribute
+        # Python access; any other layout (e.g. visibility set) takes the slow path
+        buffer = face_landmarks.SerializeToString()
+        raw = np.frombuffer(buffer, dtype=np.uint8)
+        if (len(raw) == len(landmarks_array) * LANDMARK_RECORD_SIZE
+                and (raw.reshape(-1, LANDMARK_RECORD_SIZE)[:, _LANDMARK_TAG_COLUMNS] == _LANDMARK_TAGS).all()):
+            xyz = np.ndarray((len(landmarks_array), 3), dtype='<f4', buffer=buffer, offset=3,
+                             strides=(LANDMARK_RECORD_SIZE, 5))
+            return np.multiply(xyz, (width, height, width), out=landmarks_array)
         
-        return embedding
+        landmarks_array[:] = [(lm.x, lm.y, lm.z) for lm in face_landmarks.landmark]
+        landmarks_array *= (width, height, width)
+        return landmarks_array
+    
+    def _generate_embedding_from_landmarks(self, landmarks_array: np.ndarray) -> np.ndarray:
+        """
+        Generate a 128-dimensional face embedding from facial landmarks
+        Uses geometric features and distances between key facial points
+        """
+        return _embedding_kernel(landmarks_array)
     
-    def _calculate_landmark_confidence(self, landmarks_3d: List[Dict], width: int, height: int) -> float:
+    def _calculate_landmark_confidence(self, landmarks_array: np.ndarray, width: int, height: int) -> float:
         """
         Calculate confidence score (0.0-1.0) based on landmark quality
         Factors:
@@ -255,17 +691,17 @@ class FaceRecognitionService:
         - Face position (centered is better)
         - Landmark distribution (well-spread is better)
         """
-        if not landmarks_3d or len(landmarks_3d) == 0:
+        if len(landmarks_array) == 0:
             return 0.0
         
         # Calculate face bounding box
-        xs = [lm["x"] for lm in landmarks_3d]
-        ys = [lm["y"] for lm in landmarks_3d]
+        min_x, min_y, _ = landmarks_array.min(axis=0).tolist()
+        max_x, max_y, _ = landmarks_array.max(axis=0).tolist()
         
-        face_width = max(xs) - min(xs)
-        face_height = max(ys) - min(ys)
-        face_center_x = (max(xs) + min(xs)) / 2
-        face_center_y = (max(ys) + min(ys)) / 2
+        face_width = max_x - min_x
+        face_height = max_y - min_y
+        face_center_x = (max_x + min_x) / 2
+        face_center_y = (max_y + min_y) / 2
         
         # Factor 1: Face size (0.0-0.4)
         # Optimal face size is 30-70% of image width
@@ -287,8 +723,7 @@ class FaceRecognitionService:
         
         # Factor 3: Landmark distribution (0.0-0.3)
         # Well-distributed landmarks indicate good detection
-        z_values = [lm["z"] for lm in landmarks_3d]
-        z_std = np.std(z_values) if len(z_values) > 0 else 0
+        z_std = float(landmarks_array[:, 2].std())
         # Normalize z_std relative to face width
         z_std_normalized = z_std / (face_width + 1e-6)
         distribution_score = min(0.3, z_std_normalized * 0.5)
@@ -299,6 +734,111 @@ class FaceRecognitionService:
         # Ensure confidence is between 0.0 and 1.0
         return max(0.0, min(1.0, confidence))
 
+def run_command(service: FaceRecognitionService, command: str, images_base64: List[str]):
+    """
+    Run a CLI command on base64 images
+    """
+    if command == "detect":
+        return service.detect_faces(images_base64[0])
+    elif command == "extract":
+        return service.extract_landmarks_and_embedding(images_base64[0])
+    elif command == "detect_batch":
+        return service.detect_faces_batch(images_base64)
+    elif command == "extract_batch":
+        return service.extract_batch(images_base64)
+    return {"error": "Unknown command"}
+
+def _handle_request(service: FaceRecognitionService, request: Dict):
+    """
+    Answer one worker request, either
+    {"command": <CLI command>, "images": [<base64>, ...]} or
+    {"command": "detect" | "extract", "shm": <SharedMemory name>, "shape": [h, w, 3]}
+    where the shared memory block holds raw BGR uint8 pixels (no base64 or JPEG decode)
+    """
+    if "shm" not in request:
+        return run_command(service, request.get("command"), request.get("images") or [""])
+    
+    import sys
+    from multiprocessing import resource_tracker, shared_memory
+    
+    # The client owns the block. Before 3.13, attaching registers it with this
+    # process's resource tracker, which would unlink it when the worker exits
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=request["shm"], track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=request["shm"])
+        resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        # Copied out so the block is released before processing
+        view = np.ndarray(tuple(request["shape"]), dtype=np.uint8, buffer=shm.buf)
+        image = view.copy()
+        del view
+    finally:
+        shm.close()
+    
+    if request.get("command") == "detect":
+        return service.detect_faces_in_image(image)
+    elif request.get("command") == "extract":
+        return service.extract_from_image(image)
+    return {"error": "Unknown command"}
+
+def _answer(service: FaceRecognitionService, message: bytes) -> bytes:
+    """JSON reply to one JSON request message"""
+    try:
+        result = _handle_request(service, json.loads(message))
+    except Exception as e:
+        result = {"error": str(e)}
+    return _to_json(result).encode()
+
+def _serve_connection(service: FaceRecognitionService, conn, pool: ThreadPoolExecutor):
+    """Read requests from one client connection until it closes, answering each on the pool"""
+    with conn:
+        while True:
+            try:
+                message = conn.recv_bytes()
+            except (EOFError, OSError):
+                return
+            
+            reply = pool.submit(_answer, service, message).result()
+            try:
+                conn.send_bytes(reply)
+            except OSError:
+                return
+
+def serve(socket_path: str):
+    """
+    Persistent worker on a Unix socket
+    One service answers all requests, so process start-up and MediaPipe graph
+    construction are paid once instead of per call. Messages are JSON sent with
+    multiprocessing.connection send_bytes/recv_bytes. Each connection gets a daemon
+    reader thread, and requests (not connections) run on a fixed thread pool so each
+    thread's graphs stay warm and idle clients never hold a worker
+    """
+    from multiprocessing.connection import Listener
+    
+    service = FaceRecognitionService()
+    
+    # Stale socket from a previous run; anything else at the path is left alone
+    # (and makes the bind below fail)
+    try:
+        if stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+    
+    pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+    try:
+        with Listener(socket_path, family='AF_UNIX') as listener:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=_serve_connection, args=(service, conn, pool), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Reader threads may be blocked on idle clients; they are daemons, so exit
+        # without waiting on them or on queued requests
+        pool.shutdown(wait=False, cancel_futures=True)
+
 def main():
     """
     Command-line interface for testing
@@ -306,23 +846,21 @@ def main():
     import sys
     
     if len(sys.argv) < 3:
-        print("Usage: python face_service.py <command> <image_base64>")
-        print("Commands: detect, extract")
+        print("Usage: python face_service.py <command> <image_base64> [<image_base64> ...]")
+        print("       python face_service.py serve <socket_path>")
+        print("Commands: detect, extract, detect_batch, extract_batch")
         sys.exit(1)
     
     command = sys.argv[1]
-    image_base64 = sys.argv[2]
     
-    service = FaceRecognitionService()
+    if command == "serve":
+        serve(sys.argv[2])
+        return
     
-    if command == "detect":
-        result = service.detect_faces(image_base64)
-    elif command == "extract":
-        result = service.extract_landmarks_and_embedding(image_base64)
-    else:
-        result = {"error": "Unknown command"}
+    service = FaceRecognitionService()
+    result = run_command(service, command, sys.argv[2:])
     
-    print(json.dumps(result))
+    print(_to_json(result))
 
 if __name__ == "__main__":
     main()
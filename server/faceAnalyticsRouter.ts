@@ -143,6 +143,15 @@ export const faceAnalyticsRouter = router({
           service: response.data.service,
         };
       } catch (error) {
+        // Up but still loading its models (503 with status 'loading')
+        if (axios.isAxiosError(error) && error.response?.data?.status) {
+          return {
+            available: false,
+            status: error.response.data.status,
+            service: error.response.data.service,
+          };
+        }
+
         return {
           available: false,
           error: 'Service not reachable',
@@ -20,7 +20,10 @@ export interface FaceQualityResult {
     score: number;
     quality: string;
     angle_estimate: string;
-    eyes_detected: number;
+    // Haar path only: MediaPipe always places both eye keypoints, so it has no count
+    eyes_detected?: number;
+    // MediaPipe keypoint path only (use_keypoints): 1.0 = frontal, 0.0 = full profile
+    yaw_ratio?: number;
   };
 }
 
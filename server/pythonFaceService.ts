@@ -33,6 +33,7 @@ interface FaceExtractionResult {
       z: number;
     }>;
     embedding: number[];
+    embedding_int8?: number[];
     landmark_count: number;
     confidence?: number;
   }>;